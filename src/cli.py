@@ -2,15 +2,26 @@
 
 import re
 import argparse
+import functools
+import json
+import multiprocessing
+import os
 from pathlib import Path
+import socket
 import sys
 import threading
-from gcode_simulator.gcode_simulator import GCodeSimulator
+import datetime
+from lib.gcode_simulator import GCodeSimulator, GrblSettings
 from gen_gcode import process_svg_to_gcode
+from gen_gcode_daemon import SOCKET_PATH
+from lib import bgcode
 from serial_device.xidraw_finder import find_4xidraw_port
 from wakepy import keep
 import readline
 
+# ;-to-end-of-line and (...) comments, stripped file-wide in one pass
+COMMENT_RE = re.compile(r';[^\n]*|\([^)]*\)')
+
 def send_command(command):
     try:
         serial_port = find_4xidraw_port()
@@ -78,16 +89,21 @@ def plot_gcode(file):
 
             serial_port.start()
 
-            with open(file, 'r') as f:
-                for l in f.readlines():
-                    # remove comments
-                    l = re.sub(r';.+$', '', l)
+            if str(file).endswith('.bgcode'):
+                # packed binary gcode, decoded record by record
+                for l in bgcode.decode_lines(file):
+                    serial_port.add_command(l)
+            else:
+                # strip comments with a single pass over the whole file
+                # rather than one regex call per line
+                gcode = COMMENT_RE.sub('', Path(file).read_text())
 
+                for l in gcode.splitlines():
                     if l.strip() == '':
                         continue
 
-                    serial_port.add_command(l)
-                
+                    serial_port.add_command(l + '\n')
+
             serial_port.wait_for_empty_queue()
             serial_port.wait_for_empty_planner_buffer()
             serial_port.stop_and_join()
@@ -103,21 +119,45 @@ def plot_gcode(file):
             serial_port.close()
 
 
-def gen_gcode(svg_file, split_layers, page_size, output_file, *, 
+def _daemon_convert(job):
+    """
+    Forward a conversion job to a running gen_gcode daemon, if any.
+
+    Returns True when the daemon handled the job, False when no daemon
+    is reachable (the caller then converts in-process).
+    """
+    if not SOCKET_PATH.exists():
+        return False
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(SOCKET_PATH))
+            sock.sendall(json.dumps(job).encode() + b'\n')
+            reply = json.loads(sock.makefile().readline())
+    except (OSError, ValueError):
+        return False # stale socket, fall back to converting in-process
+
+    if reply.get('status') != 'ok':
+        raise RuntimeError(reply.get('message', 'daemon error'))
+
+    return True
+
+
+def gen_gcode(svg_file, split_layers, page_size, output_file, *,
     pen_speed='2000',
     pen_up_delay='0.1', 
     pen_down_delay='0.2',
     exclude_layers=[],
     line_simplify_tolerance='0.1mm',
-    line_sort=True
+    line_sort=True,
+    compact=False,
+    binary=False
 ):
     if not output_file:
         path = Path(svg_file)
         output_file = str(path.parent / path.stem)
-    
-    process_svg_to_gcode(
-        svg_file, 
-        output_file, 
+
+    options = dict(
         target_page_size=page_size,
         split_layers=split_layers,
         pen_speed=pen_speed,
@@ -125,9 +165,17 @@ def gen_gcode(svg_file, split_layers, page_size, output_file, *,
         pen_down_delay=pen_down_delay,
         exclude_layers=exclude_layers,
         line_simplify_tolerance=line_simplify_tolerance,
-        line_sort=line_sort
+        line_sort=line_sort,
+        compact=compact,
+        binary=binary
     )
 
+    # a running daemon has vpype imported already, much faster for batches
+    if _daemon_convert(dict(input_svg=svg_file, output_gcode=output_file, **options)):
+        return
+
+    process_svg_to_gcode(svg_file, output_file, **options)
+
 def query(command):
     try:
         serial_port = find_4xidraw_port()
@@ -160,7 +208,7 @@ if __name__ == '__main__':
 
     # gen_gcode sub-command
     parser_gen = subparsers.add_parser('gen_gcode', help='Generate G-code from SVG file')
-    parser_gen.add_argument('svg_file', type=str, help='SVG file to convert')
+    parser_gen.add_argument('svg_file', type=str, nargs='+', help='SVG file(s) to convert')
     parser_gen.add_argument('--split-layers', action='store_true', help='Split into separate layers')
     parser_gen.add_argument('--target-page-size', type=str, default='297x210mm', help='Target page size (default: horizontal A4)')
     parser_gen.add_argument('--output', type=str, help='Output file base name')
@@ -170,6 +218,8 @@ if __name__ == '__main__':
     parser_gen.add_argument('--exclude-layers', type=str, default='', help='Layer IDs to exclude (comma separated)')
     parser_gen.add_argument('--line-simplify-tolerance', type=str, default='0.1mm', help='Line simplification tolerance')
     parser_gen.add_argument('--no-line-sort', action='store_false', dest='line_sort', help='Disable line sorting')
+    parser_gen.add_argument('--compact', action='store_true', help='Rewrite output in relative (G91) mode with shorter lines')
+    parser_gen.add_argument('--binary', action='store_true', help='Also write a packed .bgcode sidecar')
     parser_gen.set_defaults(line_sort=True)
 
     # serial sub-command
@@ -193,18 +243,42 @@ if __name__ == '__main__':
 
     elif args.action == 'gen_gcode':
         exclude_layers = args.exclude_layers.split(',') if args.exclude_layers else []
-        gen_gcode(
-            args.svg_file, 
-            args.split_layers, 
-            args.target_page_size, 
-            args.output,
-            pen_speed=args.pen_speed,
-            pen_up_delay=args.pen_up_delay,
-            pen_down_delay=args.pen_down_delay,
-            exclude_layers=exclude_layers,
-            line_simplify_tolerance=args.line_simplify_tolerance,
-            line_sort=args.line_sort
-        )
+
+        if len(args.svg_file) == 1:
+            gen_gcode(
+                args.svg_file[0],
+                args.split_layers,
+                args.target_page_size,
+                args.output,
+                pen_speed=args.pen_speed,
+                pen_up_delay=args.pen_up_delay,
+                pen_down_delay=args.pen_down_delay,
+                exclude_layers=exclude_layers,
+                line_simplify_tolerance=args.line_simplify_tolerance,
+                line_sort=args.line_sort,
+                compact=args.compact,
+                binary=args.binary
+            )
+        else:
+            # the vpype pipeline is CPU-bound, convert batches in parallel
+            # (one process per file, output names derived from the inputs)
+            convert = functools.partial(
+                gen_gcode,
+                split_layers=args.split_layers,
+                page_size=args.target_page_size,
+                output_file=None,
+                pen_speed=args.pen_speed,
+                pen_up_delay=args.pen_up_delay,
+                pen_down_delay=args.pen_down_delay,
+                exclude_layers=exclude_layers,
+                line_simplify_tolerance=args.line_simplify_tolerance,
+                line_sort=args.line_sort,
+                compact=args.compact,
+                binary=args.binary
+            )
+
+            with multiprocessing.Pool(min(len(args.svg_file), os.cpu_count())) as pool:
+                pool.map(convert, args.svg_file)
 
     elif args.action == 'serial':
         interactive_serial_session()
@@ -216,7 +290,13 @@ if __name__ == '__main__':
         parser.print_help()
 
     elif args.action == 'simulate':
-        simulator = GCodeSimulator()
+        simulator = GCodeSimulator(GrblSettings())
+
+        with open(args.gcode_file, 'r') as f:
+            total_time, bounds = simulator.estimate_time(f)
+
+        print(f'Estimated execution time: {datetime.timedelta(seconds=round(total_time))}')
+        print(f'Bounds: X {bounds.min_x:.1f} to {bounds.max_x:.1f}, Y {bounds.min_y:.1f} to {bounds.max_y:.1f}')
 
     else:
         print(f'Unrecognized command {args.action}')
\ No newline at end of file
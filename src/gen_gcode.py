@@ -1,11 +1,257 @@
+import os
 from pathlib import Path
+import re
 import tempfile
-import vpype
-from vpype_cli import execute
+import numpy as np
 import json
 
-def process_svg_to_gcode(input_svg, output_gcode, *, 
-    target_page_size='297x210mm', 
+try:
+    from .lib import bgcode # when imported as part of the src package (server)
+except ImportError:
+    from lib import bgcode # when run with src/ on the path (cli)
+
+# two-opt refinement is quadratic-ish in the number of paths, past this
+# many paths the greedy nearest-neighbor sort alone is the better trade
+TWO_OPT_MAX_PATHS = 2000
+
+
+def _chord_sq_distances(line, start, end):
+    """
+    Squared perpendicular distance of every interior point of
+    line[start:end+1] to the start-end chord, in one vectorized pass.
+    """
+    chord = line[end] - line[start]
+    rel = line[start + 1:end] - line[start]
+    chord_sq = chord.real * chord.real + chord.imag * chord.imag
+
+    if chord_sq == 0:  # degenerate chord: plain distance to the endpoint
+        return rel.real * rel.real + rel.imag * rel.imag
+
+    cross = rel.real * chord.imag - rel.imag * chord.real
+    return cross * cross / chord_sq
+
+
+def _simplify_segment(line, start, end, sq_tolerance, keep):
+    """
+    Ramer-Douglas-Peucker over line[start:end+1], marking kept vertices.
+
+    Iterative with an explicit span stack, so deeply nested splits
+    (long spiral-like paths) cannot hit the recursion limit.
+    """
+    spans = [(start, end)]
+
+    while spans:
+        start, end = spans.pop()
+
+        if end <= start + 1:
+            continue
+
+        sq_dist = _chord_sq_distances(line, start, end)
+        farthest = int(np.argmax(sq_dist))
+
+        if sq_dist[farthest] > sq_tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            spans.append((start, split))
+            spans.append((split, end))
+
+
+def simplify_line(line, tolerance):
+    """Simplify one polyline (1D complex array) with tolerance in pixels."""
+    if len(line) <= 2:
+        return line
+
+    keep = np.zeros(len(line), dtype=bool)
+    keep[0] = keep[-1] = True
+    _simplify_segment(line, 0, len(line) - 1, tolerance * tolerance, keep)
+
+    return line[keep]
+
+
+def _precompute_segment(line, start, end, deviations):
+    """
+    Douglas-Peucker with tolerance 0, recording for each vertex the
+    deviation at which it would be eliminated. Iterative, like
+    _simplify_segment.
+    """
+    spans = [(start, end)]
+
+    while spans:
+        start, end = spans.pop()
+
+        if end <= start + 1:
+            continue
+
+        sq_dist = _chord_sq_distances(line, start, end)
+        farthest = int(np.argmax(sq_dist))
+        split = start + 1 + farthest
+
+        deviations[split] = np.sqrt(sq_dist[farthest])
+
+        if sq_dist[farthest] > 0:
+            spans.append((start, split))
+            spans.append((split, end))
+
+
+def simplify_precompute(line):
+    """
+    Per-vertex Douglas-Peucker deviations for one polyline.
+
+    Filtering the line with `deviations >= tolerance` afterwards is a
+    linear-time equivalent of re-running the simplification, so the
+    tolerance can be retuned without recursing again.
+    """
+    deviations = np.zeros(len(line))
+    deviations[0] = deviations[-1] = np.inf
+
+    _precompute_segment(line, 0, len(line) - 1, deviations)
+
+    return deviations
+
+
+def _simplify_cache_path(input_svg) -> Path:
+    return Path(f'{input_svg}.simplify-cache.npz')
+
+
+def load_simplify_deviations(input_svg, doc, scale_factor):
+    """
+    Per-layer Douglas-Peucker deviations for the document, in document
+    (scaled) units.
+
+    Deviations are cached in a sidecar .npz next to the SVG, keyed by
+    the SVG's mtime and stored in SVG units so any page size can reuse
+    them. Layers whose cache entry is missing or stale are recomputed.
+    """
+    cache_path = _simplify_cache_path(input_svg)
+    mtime = os.path.getmtime(input_svg)
+
+    cached = {}
+    if cache_path.exists():
+        try:
+            data = np.load(cache_path)
+            if float(data['mtime']) == mtime:
+                cached = data
+        except (OSError, ValueError, KeyError):
+            pass  # unreadable cache, recompute below
+
+    deviations = {}
+    store = {}
+    dirty = False
+
+    for lid, layer in doc.layers.items():
+        lengths = np.array([len(line) for line in layer.lines])
+
+        if (
+            f'layer{lid}_lens' in cached
+            and np.array_equal(cached[f'layer{lid}_lens'], lengths)
+        ):
+            layer_devs = np.split(
+                cached[f'layer{lid}_devs'], np.cumsum(lengths)[:-1]
+            )
+        else:
+            # doc is already scaled, normalize back to SVG units for the cache
+            layer_devs = [
+                simplify_precompute(line) / scale_factor for line in layer.lines
+            ]
+            dirty = True
+
+        store[f'layer{lid}_lens'] = lengths
+        store[f'layer{lid}_devs'] = (
+            np.concatenate(layer_devs) if layer_devs else np.array([])
+        )
+
+        deviations[lid] = [devs * scale_factor for devs in layer_devs]
+
+    if dirty:
+        try:
+            np.savez(cache_path, mtime=mtime, **store)
+        except OSError:
+            pass  # read-only location, caching is best-effort
+
+    return deviations
+
+
+def fast_simplify(doc, tolerance, deviations=None):
+    """
+    Simplify every polyline of the document in place.
+
+    Replaces vpype's linesimplify (shapely-backed, one call per line)
+    with an in-repo Douglas-Peucker working directly on the complex
+    coordinate arrays. When precomputed `deviations` are given the
+    simplification is a vectorized filter instead of a recursion.
+    """
+    for lid, layer in doc.layers.items():
+        if deviations is not None:
+            doc.replace(
+                [
+                    line[devs >= tolerance]
+                    for line, devs in zip(layer.lines, deviations[lid])
+                ],
+                lid,
+            )
+        else:
+            doc.replace([simplify_line(l, tolerance) for l in layer.lines], lid)
+
+    return doc
+
+
+_MOTION_RE = re.compile(r'^(G0?[01]) X(-?[\d.]+) Y(-?[\d.]+)(?: F(-?[\d.]+))?$')
+
+
+def _fmt_coord(value):
+    """Format a coordinate with up to 2 decimals, no trailing zeros."""
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+def compact_gcode(gcode_file):
+    """
+    Rewrite a generated gcode file in relative (G91) mode.
+
+    Deltas between consecutive points are much shorter to express than
+    absolute coordinates, and the feed rate is only repeated when it
+    changes, roughly halving the bytes per line sent over serial.
+    Rounding is compensated against the real target so errors do not
+    accumulate.
+    """
+    path = Path(gcode_file)
+    out_lines = []
+    pos_x = pos_y = 0.0
+    feed = None
+
+    for line in path.read_text().splitlines():
+        if line.strip() == 'G90':
+            out_lines.append('G91')
+            continue
+
+        match = _MOTION_RE.match(line.strip())
+        if not match:
+            out_lines.append(line)
+            continue
+
+        code = 'G0' if match.group(1) in ('G0', 'G00') else 'G1'
+        target_x = float(match.group(2))
+        target_y = float(match.group(3))
+
+        # round the delta against the true target, so the rounding error
+        # of one move is recovered by the next one
+        delta_x = round(target_x - pos_x, 2)
+        delta_y = round(target_y - pos_y, 2)
+        pos_x += delta_x
+        pos_y += delta_y
+
+        words = [code, f'X{_fmt_coord(delta_x)}', f'Y{_fmt_coord(delta_y)}']
+
+        if match.group(4) is not None and match.group(4) != feed:
+            feed = match.group(4)
+            words.append(f'F{feed}')
+
+        out_lines.append(' '.join(words))
+
+    path.write_text('\n'.join(out_lines) + '\n')
+
+
+def process_svg_to_gcode(input_svg, output_gcode, *,
+    target_page_size='297x210mm',
     split_layers=False,
     pen_speed='3000',
     pen_up_delay='0.1',
@@ -13,7 +259,12 @@ def process_svg_to_gcode(input_svg, output_gcode, *,
     exclude_layers=[], # list of layer ids (numbers) to exclude from the gcode
     line_simplify_tolerance='0.1mm',
     line_sort=True,
+    compact=False, # rewrite the output in relative (G91) mode
+    binary=False, # also write a packed .bgcode sidecar
 ):
+    # vpype takes ~1s to import, only pay for it when actually converting
+    import vpype
+    from vpype_cli import execute
 
     doc = vpype.read_multilayer_svg(input_svg, 1)
 
@@ -37,10 +288,17 @@ def process_svg_to_gcode(input_svg, output_gcode, *,
     print(f"SVG scale factor: {scale_factor}")
     
     if line_simplify_tolerance:
-        doc = execute(f"linesimplify -t {line_simplify_tolerance}", doc)
+        tolerance = vpype.convert_length(line_simplify_tolerance)
+        deviations = load_simplify_deviations(input_svg, doc, scale_factor)
+        doc = fast_simplify(doc, tolerance, deviations)
 
     if line_sort:
-        doc = execute("linesort --two-opt", doc)
+        path_count = sum(len(layer) for layer in doc.layers.values())
+        if path_count <= TWO_OPT_MAX_PATHS:
+            doc = execute("linesort --two-opt", doc)
+        else:
+            print(f"{path_count} paths, skipping two-opt refinement")
+            doc = execute("linesort", doc)
 
     config = Path('config/vpype-gcode.toml').read_text()
 
@@ -59,6 +317,22 @@ def process_svg_to_gcode(input_svg, output_gcode, *,
         else:
             execute(f"gwrite --profile 4xidraw '{output_gcode}.gcode'", doc)
 
+    if split_layers:
+        # the same layer ids gwrite substituted for %_lid% above; a
+        # directory glob would also pick up leftover layer files from a
+        # previous run with a different layer set
+        out_files = [Path(f'{output_gcode}-{lid}.gcode') for lid in sorted(doc.layers)]
+    else:
+        out_files = [Path(f'{output_gcode}.gcode')]
+
+    if compact:
+        for out_file in out_files:
+            compact_gcode(out_file)
+
+    if binary:
+        for out_file in out_files:
+            bgcode.encode(out_file)
+
     return width, height
 
 if __name__ == "__main__":
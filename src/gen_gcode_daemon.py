@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Persistent gen_gcode worker.
+
+Importing vpype costs a second or two per process, which dominates when
+converting many SVGs one cli call at a time. This daemon imports vpype
+once and then accepts conversion jobs over a unix socket: one JSON
+object per line with input_svg, output_gcode and any
+process_svg_to_gcode keyword option, answered by one JSON line.
+
+The cli forwards gen_gcode invocations here automatically whenever the
+socket exists; without a daemon it falls back to converting in-process.
+
+    python3 src/gen_gcode_daemon.py
+"""
+
+import json
+import os
+from pathlib import Path
+import socketserver
+import tempfile
+
+from gen_gcode import process_svg_to_gcode
+
+SOCKET_PATH = Path(
+    os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+) / '4xidraw-gen.sock'
+
+
+class GenGcodeHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+
+        try:
+            job = json.loads(line)
+            width, height = process_svg_to_gcode(
+                job.pop('input_svg'), job.pop('output_gcode'), **job
+            )
+            reply = {'status': 'ok', 'width': width, 'height': height}
+        except Exception as e:
+            reply = {'status': 'error', 'message': str(e)}
+
+        self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+def main():
+    # pay the vpype import once, before the first job arrives
+    import vpype  # noqa: F401
+    import vpype_cli  # noqa: F401
+
+    if SOCKET_PATH.exists():
+        SOCKET_PATH.unlink()
+
+    with socketserver.UnixStreamServer(str(SOCKET_PATH), GenGcodeHandler) as server:
+        print(f'gen_gcode daemon listening on {SOCKET_PATH}')
+        try:
+            server.serve_forever()
+        finally:
+            SOCKET_PATH.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Packed binary gcode (.bgcode) encoder/decoder.
+
+Each command is one fixed-width 5-byte record: an op byte plus two
+int16 arguments (struct '<Bhh'). Motion records store deltas in 0.01mm
+steps, so a typical 'G01 X123.45 Y67.89 F2000' line shrinks from ~30
+bytes to 5. The decoder expands records back to plain absolute-mode
+gcode lines just before they are sent to the plotter.
+"""
+
+from pathlib import Path
+import re
+import struct
+
+RECORD = struct.Struct('<Bhh')
+
+# largest magnitude one int16 argument can carry: 327.67mm of motion
+# or 32.767s of dwell per record
+ARG_MAX = 32767
+
+OP_RAPID = 0  # rapid move, args: dx, dy (0.01mm)
+OP_LINE = 1  # linear move, args: dx, dy (0.01mm)
+OP_PEN = 2  # M3, arg1: S value
+OP_DWELL = 3  # G4, arg1: milliseconds
+OP_FEED = 4  # feed change, arg1: mm/min
+OP_UNITS = 5  # G21 preamble
+OP_ABSOLUTE = 6  # G90/G91 preamble (decoded as absolute mode)
+
+# resolution of the stored deltas, in mm
+STEP = 0.01
+
+_MOTION_RE = re.compile(r'^(G0?[01]) X(-?[\d.]+) Y(-?[\d.]+)(?: F(-?[\d.]+))?$')
+
+
+def _fmt(value: float) -> str:
+    """2-decimal coordinate with trailing zeros trimmed ('X0' not 'X0.00')."""
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+_PEN_RE = re.compile(r'^M0?3 S(\d+)$')
+_DWELL_RE = re.compile(r'^G0?4 P(-?[\d.]+)$')
+
+
+def _motion_records(op, delta_x, delta_y):
+    """
+    Pack one motion into one or more records. A delta beyond the int16
+    range (327.67mm, e.g. an A3 traverse) is split into intermediate
+    moves along the same line whose integer steps sum exactly to the
+    true target, so the drift-free position tracking is preserved.
+    """
+    chunks = max(1, -(-abs(delta_x) // ARG_MAX), -(-abs(delta_y) // ARG_MAX))
+
+    sent_x = sent_y = 0
+    for i in range(1, chunks + 1):
+        step_x = delta_x * i // chunks - sent_x
+        step_y = delta_y * i // chunks - sent_y
+        sent_x += step_x
+        sent_y += step_y
+        yield RECORD.pack(op, step_x, step_y)
+
+
+def encode(gcode_file, bgcode_file=None) -> Path:
+    """
+    Encode an ASCII gcode file (absolute or relative mode) into a packed
+    .bgcode sidecar. Unknown lines and comments are dropped.
+    """
+    source = Path(gcode_file)
+    target = Path(bgcode_file) if bgcode_file else source.with_suffix('.bgcode')
+
+    records = []
+    relative = False
+    feed = None
+    # emitted position in integer steps, so rounding never accumulates
+    pos_x = pos_y = 0
+
+    for line in source.read_text().splitlines():
+        line = line.strip()
+
+        match = _MOTION_RE.match(line)
+        if match:
+            x = float(match.group(2))
+            y = float(match.group(3))
+
+            if relative:
+                delta_x = round(x / STEP)
+                delta_y = round(y / STEP)
+            else:
+                delta_x = round(x / STEP) - pos_x
+                delta_y = round(y / STEP) - pos_y
+
+            pos_x += delta_x
+            pos_y += delta_y
+
+            if match.group(4) is not None and match.group(4) != feed:
+                feed = match.group(4)
+                records.append(RECORD.pack(OP_FEED, round(float(feed)), 0))
+
+            op = OP_RAPID if match.group(1) in ('G0', 'G00') else OP_LINE
+            records.extend(_motion_records(op, delta_x, delta_y))
+            continue
+
+        match = _PEN_RE.match(line)
+        if match:
+            records.append(RECORD.pack(OP_PEN, int(match.group(1)), 0))
+            continue
+
+        match = _DWELL_RE.match(line)
+        if match:
+            # dwells over 32.767s are split, consecutive G4s accumulate
+            ms = round(float(match.group(1)) * 1000)
+            while ms > ARG_MAX:
+                records.append(RECORD.pack(OP_DWELL, ARG_MAX, 0))
+                ms -= ARG_MAX
+            records.append(RECORD.pack(OP_DWELL, ms, 0))
+            continue
+
+        if line == 'G21':
+            records.append(RECORD.pack(OP_UNITS, 0, 0))
+        elif line in ('G90', 'G91'):
+            relative = line == 'G91'
+            records.append(RECORD.pack(OP_ABSOLUTE, 0, 0))
+
+    target.write_bytes(b''.join(records))
+
+    return target
+
+
+def decode_lines(bgcode_file):
+    """
+    Yield plain absolute-mode gcode lines (newline-terminated) from a
+    .bgcode file, one command at a time.
+    """
+    data = Path(bgcode_file).read_bytes()
+
+    pos_x = pos_y = 0
+    feed = None
+
+    for op, arg1, arg2 in RECORD.iter_unpack(data):
+        if op in (OP_RAPID, OP_LINE):
+            pos_x += arg1
+            pos_y += arg2
+            code = 'G0' if op == OP_RAPID else 'G1'
+            words = f'{code} X{_fmt(pos_x * STEP)} Y{_fmt(pos_y * STEP)}'
+            if op == OP_LINE and feed is not None:
+                words += f' F{feed}'
+                feed = None
+            yield words + '\n'
+        elif op == OP_PEN:
+            yield f'M3 S{arg1}\n'
+        elif op == OP_DWELL:
+            yield f'G4 P{arg1 / 1000:g}\n'
+        elif op == OP_FEED:
+            feed = arg1
+        elif op == OP_UNITS:
+            yield 'G21\n'
+        elif op == OP_ABSOLUTE:
+            yield 'G90\n'
@@ -0,0 +1,606 @@
+from dataclasses import dataclass
+import re
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the pure Python kernel works too
+    def njit(*args, **kwargs):
+        def wrap(func):
+            return func
+        return wrap
+
+
+@dataclass(slots=True)
+class GrblSettings:
+    max_rate_x: float = 3000.0  # mm/min ($110)
+    max_rate_y: float = 3000.0  # mm/min ($111)
+    max_accel_x: float = 800.0  # mm/s^2 ($120)
+    max_accel_y: float = 800.0  # mm/s^2 ($121)
+    junction_deviation: float = 0.01  # mm ($11)
+    grbl_version: str = '0.9i'  # Version of GRBL used
+
+
+@dataclass(slots=True)
+class Point:
+    x: float = 0.0
+    y: float = 0.0
+
+    def __sub__(self, other: 'Point') -> 'Point':
+        return Point(self.x - other.x, self.y - other.y)
+
+    def __add__(self, other: 'Point') -> 'Point':
+        return Point(self.x + other.x, self.y + other.y)
+
+    def length(self) -> float:
+        return math.hypot(self.x, self.y)
+
+    def normalize(self) -> 'Point':
+        length = self.length()
+        if length == 0:
+            return Point(0, 0)
+        return Point(self.x / length, self.y / length)
+
+    def dot_product(self, other: 'Point') -> float:
+        return self.x * other.x + self.y * other.y
+
+    def abs(self) -> 'Point':
+        return Point(abs(self.x), abs(self.y))
+
+    def scale(self, factor: float) -> 'Point':
+        return Point(self.x * factor, self.y * factor)
+
+
+@dataclass(slots=True)
+class Bounds:
+    min_x: float = float('inf')
+    max_x: float = float('-inf')
+    min_y: float = float('inf')
+    max_y: float = float('-inf')
+
+    def update(self, point: Point):
+        self.min_x = min(self.min_x, point.x)
+        self.max_x = max(self.max_x, point.x)
+        self.min_y = min(self.min_y, point.y)
+        self.max_y = max(self.max_y, point.y)
+
+    def update_many(self, xs: np.ndarray, ys: np.ndarray):
+        """Grow the bounds over whole coordinate arrays in one reduction."""
+        if len(xs) == 0:
+            return
+        self.min_x = min(self.min_x, float(np.min(xs)))
+        self.max_x = max(self.max_x, float(np.max(xs)))
+        self.min_y = min(self.min_y, float(np.min(ys)))
+        self.max_y = max(self.max_y, float(np.max(ys)))
+
+    @property
+    def width(self) -> float:
+        return self.max_x - self.min_x
+
+    @property
+    def height(self) -> float:
+        return self.max_y - self.min_y
+
+
+@dataclass(slots=True)
+class TraceNode:
+    x: float
+    y: float
+    feed: float
+    time: float
+
+
+# Matches every parameter word we care about (X10.5, F2000, P0.1, ...)
+# in one scan, instead of one re.search per letter.
+_TOKEN_RE = re.compile(r'([XYFPS])(-?(?:\d+\.?\d*|\.\d+))')
+
+# Command codes used in the parsed program arrays
+CMD_RAPID = 0  # G0/G00
+CMD_LINEAR = 1  # G1/G01
+CMD_DWELL = 2  # G4
+CMD_PEN = 3  # M3
+
+# Command code by first word of the line, one hash lookup per line
+# instead of a substring scan per candidate command (this also stops
+# e.g. M30 from being mistaken for M3).
+_CMD_BY_CODE = {
+    'G0': CMD_RAPID,
+    'G00': CMD_RAPID,
+    'G1': CMD_LINEAR,
+    'G01': CMD_LINEAR,
+    'G4': CMD_DWELL,
+    'G04': CMD_DWELL,
+    'M3': CMD_PEN,
+    'M03': CMD_PEN,
+}
+
+
+def is_go_home_command(line: str) -> bool:
+    command = sorted(line.split())
+    return command == ['G0', 'X0', 'Y0'] or command == ['G00', 'X0', 'Y0']
+
+
+def _parse_motion_words(line: str) -> tuple[float, float, float]:
+    """Regex fallback for motion lines the word tokenizer cannot parse."""
+    x, y, f = math.nan, math.nan, math.nan
+    for match in _TOKEN_RE.finditer(line):
+        letter = match.group(1)
+        if letter == 'X':
+            x = float(match.group(2))
+        elif letter == 'Y':
+            y = float(match.group(2))
+        elif letter == 'F':
+            f = float(match.group(2))
+    return x, y, f
+
+
+def _forward_fill(values: np.ndarray, initial: float) -> np.ndarray:
+    """Replace NaN entries with the last preceding value (or `initial`)."""
+    mask = np.isnan(values)
+    index = np.where(mask, 0, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    filled = values[index]
+    return np.where(np.isnan(filled), initial, filled)
+
+
+@njit(cache=True, fastmath=True)
+def _calculate_trapezoid(
+    distance: float,
+    start_velocity: float,
+    end_velocity: float,
+    max_velocity: float,
+    max_accel: float,
+):
+    """
+    Solve the trapezoidal velocity profile for one motion, closed-form.
+
+    All velocities are in mm/s. Returns a flat tuple of floats so the
+    function can be JIT-compiled by numba when it is installed:
+
+    (accel_distance, accel_time, cruise_distance, cruise_time,
+     decel_distance, decel_time, peak_velocity, final_velocity)
+
+    Instead of the classic four-case ladder (full trapezoid, triangle,
+    decel-only, accel-only), the profile is solved directly:
+
+    - the reachable end velocity is the target clamped into
+      [sqrt(v0^2 - 2ad), sqrt(v0^2 + 2ad)], which covers the
+      accel-only and decel-only degenerate shapes,
+    - the peak is min(vmax, sqrt((v0^2 + vend^2)/2 + ad)); the latter
+      winning is exactly the "cannot reach max velocity" condition,
+    - the cruise phase is whatever distance the accel/decel ramps to
+      that peak leave over (zero for the degenerate shapes).
+
+    The degenerate phases come out with zero length/time, so callers
+    need no case analysis, and the data-dependent branches disappear.
+    """
+    start_sq = start_velocity * start_velocity
+    reach_sq = 2.0 * max_accel * distance
+
+    # end velocity actually reachable within the distance
+    final_velocity = min(end_velocity, math.sqrt(start_sq + reach_sq))
+    final_velocity = max(final_velocity, math.sqrt(max(0.0, start_sq - reach_sq)))
+    final_sq = final_velocity * final_velocity
+
+    peak_sq = (start_sq + final_sq) / 2 + max_accel * distance
+    peak_velocity = min(max_velocity, math.sqrt(peak_sq))
+
+    accel_distance = (peak_velocity * peak_velocity - start_sq) / (2 * max_accel)
+    decel_distance = (peak_velocity * peak_velocity - final_sq) / (2 * max_accel)
+    accel_time = (peak_velocity - start_velocity) / max_accel
+    decel_time = (peak_velocity - final_velocity) / max_accel
+
+    cruise_distance = max(0.0, distance - accel_distance - decel_distance)
+    cruise_time = cruise_distance / peak_velocity if peak_velocity > 0 else 0.0
+
+    return (
+        accel_distance,
+        accel_time,
+        cruise_distance,
+        cruise_time,
+        decel_distance,
+        decel_time,
+        peak_velocity,
+        final_velocity,
+    )
+
+
+class GCodeSimulator:
+    def __init__(self, settings: GrblSettings, trace: bool = False):
+        self.settings = settings
+        self.current_pos = Point()
+        self.current_feed = 0.0
+        self.total_time = 0.0
+        self.bounds = Bounds()
+
+        # tracing is used for debugging
+        self.trace = trace
+        self.trace_location = Point()
+        self.trace_time = 0.0
+        self.trace_nodes = [TraceNode(0, 0, 0, 0)]
+
+    def _parse_program(self, lines):
+        """
+        Single pass over the gcode, turning it into parallel arrays:
+        one row per recognized command, with NaN for absent X/Y/F words.
+
+        Returns (cmds, xs, ys, fs, dwells, linenos, home_flags).
+        """
+        cmds, xs, ys, fs, dwells, linenos, home_flags = [], [], [], [], [], [], []
+
+        for i, raw in enumerate(lines):
+            line = raw.strip()
+
+            # skip blank and comment lines before any further work
+            first = line[:1]
+            if not first or first == ';' or first == '(':
+                continue
+
+            # canonical gcode is already uppercase, don't copy the line
+            # per iteration just in case it is not
+            if not line.isupper():
+                line = line.upper()
+
+            cmd = _CMD_BY_CODE.get(line.partition(' ')[0])
+
+            if cmd is None:
+                continue
+
+            if cmd <= CMD_LINEAR:
+                # split + float is ~2.5x faster than regex matching for
+                # well-formed words, which is all the generator emits
+                x, y, f = math.nan, math.nan, math.nan
+                try:
+                    for word in line.split():
+                        letter = word[0]
+                        if letter == 'X':
+                            x = float(word[1:])
+                        elif letter == 'Y':
+                            y = float(word[1:])
+                        elif letter == 'F':
+                            f = float(word[1:])
+                except ValueError:
+                    # unusual word layout, fall back to the lenient regex
+                    x, y, f = _parse_motion_words(line)
+
+                xs.append(x)
+                ys.append(y)
+                fs.append(f)
+                dwells.append(0.0)
+                home_flags.append(is_go_home_command(line))
+
+            elif cmd == CMD_DWELL:
+                xs.append(math.nan)
+                ys.append(math.nan)
+                fs.append(math.nan)
+                dwells.append(self._parse_dwell(line))
+                home_flags.append(False)
+
+            else:  # pen moves are followed or preceded by dwells
+                xs.append(math.nan)
+                ys.append(math.nan)
+                fs.append(math.nan)
+                dwells.append(0.0)
+                home_flags.append(False)
+
+            cmds.append(cmd)
+            linenos.append(i)
+
+        return (
+            np.array(cmds, dtype=np.int8),
+            np.array(xs, dtype=np.float64),
+            np.array(ys, dtype=np.float64),
+            np.array(fs, dtype=np.float64),
+            np.array(dwells, dtype=np.float64),
+            np.array(linenos, dtype=np.intp),
+            np.array(home_flags, dtype=bool),
+        )
+
+    def _parse_dwell(self, line: str) -> float:
+        p_value, s_value = None, None
+        for match in _TOKEN_RE.finditer(line):
+            letter = match.group(1)
+            if letter == 'P':
+                p_value = float(match.group(2))
+            elif letter == 'S':
+                s_value = float(match.group(2))
+
+        if p_value is not None:
+            # in grbl 0.9, P is in seconds
+            if self.settings.grbl_version.startswith('0.9'):
+                return p_value
+
+            # P is in milliseconds
+            return p_value / 1000
+
+        elif s_value is not None:  # S is in seconds
+            return s_value
+
+        return 0
+
+    def _add_trace(self, move: Point, move_time: float, new_feed: float):
+        if self.trace:
+            self.trace_time += move_time
+            self.trace_location += move
+            self.trace_nodes.append(
+                TraceNode(
+                    self.trace_location.x,
+                    self.trace_location.y,
+                    new_feed,
+                    self.trace_time,
+                )
+            )
+
+    def calculate_junction_vmax(self, dx1, dy1, dx2, dy2):
+        """
+        Calculate the maximum junction speed for a CNC machine.
+
+        Parameters:
+        - dx1, dy1: Motion vector of the first segment.
+        - dx2, dy2: Motion vector of the second segment.
+
+        Returns:
+        - vmax: Maximum junction speed (mm/min).
+        """
+
+        length1 = math.sqrt(dx1 * dx1 + dy1 * dy1)
+        length2 = math.sqrt(dx2 * dx2 + dy2 * dy2)
+
+        if length1 == 0 or length2 == 0:
+            return 0
+
+        # angle of the junction
+        dot_product = (dx1 * dx2 + dy1 * dy2) / (length1 * length2)
+        dot_product = max(-1.0, min(1.0, dot_product))  # Clamped to avoid floating point errors
+
+        # sin(theta/2) straight from the half-angle identity, saving the
+        # acos/sin round-trip (same trick as grbl's own planner)
+        sin_half_theta = math.sqrt((1.0 - dot_product) / 2.0)
+
+        # If the angle is very small, the head can pass the junction at max speed
+        if sin_half_theta < 5e-7:
+            return max(self.settings.max_rate_x, self.settings.max_rate_y)
+
+        junction_radius = self.settings.junction_deviation / sin_half_theta
+
+        max_centripetal_acceleration = min(
+            self.settings.max_accel_x, self.settings.max_accel_y
+        )
+
+        vmax_mm_s = math.sqrt(max_centripetal_acceleration * junction_radius)
+
+        return vmax_mm_s * 60.0
+
+    def _calculate_motion_time(
+        self,
+        dx: float,
+        dy: float,
+        start_velocity: float,
+        end_velocity: float,
+        max_velocity: float,
+        max_accel: float,
+    ) -> tuple[float, float]:
+        """
+        Calculate the minimum time required for a motion while respecting
+        max acceleration and max speed.
+
+        It may happen that the end velocity cannot be reached so the real end_velocity is returned.
+
+        Parameters:
+        - dx, dy: The motion vector (mm).
+        - start_velocity: The starting velocity along the motion vector (float, mm/min).
+        - end_velocity: The target velocity at the end of the motion (float, mm/min).
+        - max_velocity: The feed rate for the motion (float, mm/min).
+        - max_accel: The maximum acceleration for the motion (float, mm/s^2).
+
+        Returns:
+        - motion_time: The time required for the motion (float, seconds).
+        - final_velocity: The final velocity (float, mm/min) at the end of the motion.
+        """
+        distance = math.sqrt(dx * dx + dy * dy)
+
+        # The solver works on primitives only (mm/s) so it can be JIT-compiled
+        (
+            accel_distance,
+            accel_time,
+            cruise_distance,
+            cruise_time,
+            decel_distance,
+            decel_time,
+            peak_velocity,
+            final_velocity,
+        ) = _calculate_trapezoid(
+            distance,
+            start_velocity / 60.0,
+            end_velocity / 60.0,
+            max_velocity / 60.0,
+            max_accel,
+        )
+
+        if self.trace:
+            # one node per non-degenerate phase of the profile
+            motion_dir = Point(dx / distance, dy / distance)
+            if accel_time > 0:
+                self._add_trace(
+                    motion_dir.scale(accel_distance), accel_time, peak_velocity * 60.0
+                )
+            if cruise_time > 0:
+                self._add_trace(
+                    motion_dir.scale(cruise_distance), cruise_time, peak_velocity * 60.0
+                )
+            if decel_time > 0:
+                self._add_trace(
+                    motion_dir.scale(decel_distance), decel_time, final_velocity * 60.0
+                )
+
+        total_time = accel_time + cruise_time + decel_time
+
+        return total_time, final_velocity * 60.0  # Convert back to mm/min
+
+    def estimate_time(self, gcode) -> tuple[float, Bounds]:
+        """
+        Estimate the execution time of a gcode program.
+
+        `gcode` is either the whole program as a string, or any iterable
+        of lines (e.g. an open file), which is consumed one line at a
+        time without materializing the whole file.
+        """
+        if isinstance(gcode, str):
+            gcode = gcode.splitlines()
+
+        cmds, xs, ys, fs, dwells, linenos, home_flags = self._parse_program(gcode)
+
+        total_time = 0.0
+        bounds = Bounds()
+
+        if len(cmds) == 0:
+            return total_time, bounds
+
+        # Forward-fill absent words: a motion line without X keeps the
+        # previous X, an absent F keeps the previous feed rate.
+        xs = _forward_fill(xs, 0.0)
+        ys = _forward_fill(ys, 0.0)
+        fs = _forward_fill(fs, min(self.settings.max_rate_x, self.settings.max_rate_y))
+
+        # Dwell times are independent of motion planning, sum them in one go
+        total_time += float(np.sum(dwells))
+
+        motion_mask = cmds <= CMD_LINEAR
+        target_x = xs[motion_mask]
+        target_y = ys[motion_mask]
+        target_feed = fs[motion_mask]
+        rapid = cmds[motion_mask] == CMD_RAPID
+        motion_linenos = linenos[motion_mask]
+
+        if len(target_x) == 0:
+            return total_time, bounds
+
+        # calculate the bounds of the drawing, but ignore the last G0 X0 Y0 (return to home)
+        in_bounds = ~(home_flags[motion_mask] & (motion_linenos == linenos[-1]))
+        bounds.update_many(target_x[in_bounds], target_y[in_bounds])
+
+        # motion vectors between consecutive targets (starting from 0,0)
+        delta_x = np.diff(target_x, prepend=0.0)
+        delta_y = np.diff(target_y, prepend=0.0)
+        distances = np.hypot(delta_x, delta_y)
+
+        # Everything except the velocity chaining is order-independent,
+        # so it is computed here over whole arrays: per-move feed and
+        # acceleration limits first (the x/y ratios are scale-invariant,
+        # no need to normalize).
+        settings = self.settings
+        abs_x = np.abs(delta_x)
+        abs_y = np.abs(delta_y)
+        longest_axis = np.maximum(abs_x, abs_y)
+        safe_longest = np.where(longest_axis > 0.0, longest_axis, 1.0)
+        ratio_x = abs_x / safe_longest
+        ratio_y = abs_y / safe_longest
+
+        if (
+            settings.max_rate_x == settings.max_rate_y
+            and settings.max_accel_x == settings.max_accel_y
+        ):
+            # isotropic limits (the common case): feed and acceleration
+            # scale with the same per-direction norm, one hypot for both
+            direction_norm = np.hypot(ratio_x, ratio_y)
+            max_feeds = settings.max_rate_x * direction_norm
+            max_accels = settings.max_accel_x * direction_norm
+        else:
+            max_feeds = np.hypot(
+                settings.max_rate_x * ratio_x, settings.max_rate_y * ratio_y
+            )
+            max_accels = np.hypot(
+                settings.max_accel_x * ratio_x, settings.max_accel_y * ratio_y
+            )
+
+        feeds = np.where(
+            rapid | (target_feed <= 0.0),
+            max_feeds,
+            np.minimum(target_feed, max_feeds),
+        )
+
+        # junction speed between each move and the next, over all
+        # consecutive pairs at once (same half-angle identity as
+        # calculate_junction_vmax); a junction only exists when the next
+        # gcode line is also a non-degenerate motion
+        adjacent = motion_linenos[1:] == motion_linenos[:-1] + 1
+        length_product = distances[:-1] * distances[1:]
+        valid = adjacent & (length_product > 0.0)
+
+        dot_product = delta_x[:-1] * delta_x[1:] + delta_y[:-1] * delta_y[1:]
+        cos_theta = np.clip(
+            dot_product / np.where(valid, length_product, 1.0), -1.0, 1.0
+        )
+        sin_half_theta = np.sqrt((1.0 - cos_theta) / 2.0)
+
+        min_accel = min(settings.max_accel_x, settings.max_accel_y)
+        vmax = 60.0 * np.sqrt(
+            min_accel
+            * settings.junction_deviation
+            / np.where(sin_half_theta > 0.0, sin_half_theta, 1.0)
+        )
+        vmax = np.where(
+            sin_half_theta < 5e-7,
+            max(settings.max_rate_x, settings.max_rate_y),
+            vmax,
+        )
+
+        junction_vmax = np.append(np.where(valid, vmax, 0.0), 0.0)
+
+        # realistic target end velocity of every move
+        end_velocities = np.minimum(feeds, junction_vmax)
+
+        # Only the velocity chaining is left for the loop: each move's
+        # start velocity is the previous move's real end velocity, which
+        # cannot be batched. Plain Python floats, the kernel is scalar
+        # and faster on lists than on NumPy scalars.
+        delta_x = delta_x.tolist()
+        delta_y = delta_y.tolist()
+        feeds = feeds.tolist()
+        max_accels = max_accels.tolist()
+        end_velocities = end_velocities.tolist()
+        motion_linenos = motion_linenos.tolist()
+
+        velocity = 0.0
+        move_count = len(target_x)
+        too_fast = 0
+        too_slow = 0
+
+        for i in range(move_count):
+            dx = delta_x[i]
+            dy = delta_y[i]
+
+            if dx == 0.0 and dy == 0.0:
+                continue
+
+            end_velocity = end_velocities[i]
+
+            motion_time, real_end_velocity = self._calculate_motion_time(
+                dx, dy, velocity, end_velocity, feeds[i], max_accels[i]
+            )
+
+            # This estimator has no reverse pass: segments too short for
+            # their velocity targets are expected, grbl's own planner
+            # smooths them by adjusting the preceding moves. Count them
+            # instead of warning per line.
+            if real_end_velocity - end_velocity > 1e-6:
+                # entered too fast to slow to the junction speed
+                too_fast += 1
+            elif real_end_velocity - end_velocity < -1e-6:
+                # too short to accelerate to the target feed rate
+                too_slow += 1
+                real_end_velocity = end_velocity
+
+            velocity = real_end_velocity
+            total_time += motion_time
+
+        if too_fast or too_slow:
+            print(
+                f'Warning: {too_fast + too_slow} segments too short for their '
+                f'velocity targets ({too_fast} entered too fast, {too_slow} '
+                f'could not reach their feed rate), estimate is approximate'
+            )
+
+        return total_time, bounds
@@ -1,12 +1,20 @@
-import queue
-import sys
+from collections import deque
+import logging
 import threading
 import time
 from serial import Serial
 
+logger = logging.getLogger(__name__)
+
 GRBL_BUFFER_SIZE_REFRESH_RATE = 0.05 # assumes motions are mostly 50ms long or more
 GRBL_BUFFER_NICE_SIZE = 16 # max acceptable occupancy for the planner buffer
 GRBL_BUFFER_NICE_SIZE_BLOCKING = 2 # for blocking commands like M3, empty most of the buffer first
+GRBL_RX_BUFFER_SIZE = 127 # bytes in grbl's serial receive buffer
+COMMAND_QUEUE_MAX = 4096 # queued lines before add_command blocks the producer
+
+
+class XidrawError(Exception):
+    """Grbl timed out or answered something unexpected."""
 
 
 class XidrawDevice():
@@ -17,158 +25,364 @@ class XidrawDevice():
     def __init__(self, port: Serial):
         self.port = port
         self.serial_lock = threading.Lock()
-        self.command_queue = queue.Queue()
+
+        # single-producer/single-consumer: a plain deque (append/popleft
+        # are atomic under the GIL) plus an event to wake the sender,
+        # cheaper per line than queue.Queue's lock round-trips
+        self.command_queue = deque()
+        self._queue_event = threading.Event()
+
+        # commands queued or sent but not yet acked by grbl
+        self._pending = threading.Condition()
+        self._pending_count = 0
+
+        # rate-limits the unexpected-response warning in _consume_ack
+        self._last_unexpected_warn = 0.0
+
+        # receive buffer for _readline: bytes come in by the chunk and
+        # lines are sliced out, instead of readline()'s one-byte reads
+        self._rxbuf = bytearray()
+
+        # set by cancel() or stop_and_join() to end the sender thread;
+        # an Event so it is safe to set from any thread (or a signal
+        # forwarded from another process)
+        self._stop = threading.Event()
+        self._stop.set() # not running until start()
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
 
     def command(self, command):
-        """ 
-        command is a \n terminated string 
+        """
+        command is a \n terminated string
         expects 'ok' from the board
+
+        Raises XidrawError on timeout or a non-ok answer: callers own
+        the cleanup (close the port, fail the plot), exiting the whole
+        process from here would take a Flask server down with it.
+        """
+
+        with self.serial_lock:
+
+            self.write(command)
+
+            response = self._read_response()
+
+        lines = [line.strip() for line in response.splitlines()]
+
+        if not lines or lines[-1] != 'ok':
+            raise XidrawError(f'GRBL serial timeout after command: {self._printable(command)}')
+
+        for message in lines[:-1]:
+            if message != '':
+                logger.warning('Unexpected response from GRBL. Command: %s Response: %s',
+                               self._printable(command), message)
+
+    @staticmethod
+    def _printable(command):
+        if isinstance(command, bytes):
+            command = command.decode(errors='replace')
+        return command.strip()
+
+    def _read_response(self, terminator=b'ok\r\n', size=4096):
         """
-        
+        Read grbl's whole response to one command in a single
+        timeout-bounded read, instead of a readline poll loop that eats
+        one port timeout per empty iteration. Must be called with
+        serial_lock held.
+
+        `size` bounds the read so a chattering board cannot buffer
+        forever; even a full $$ settings dump fits comfortably.
+        """
+        # anything _readline buffered came off the wire first and
+        # belongs at the front of this response
+        buffered = bytes(self._rxbuf)
+        self._rxbuf.clear()
+
+        idx = buffered.find(terminator)
+        if idx != -1:
+            self._rxbuf.extend(buffered[idx + len(terminator):])
+            return buffered[:idx + len(terminator)].decode()
+
+        previous_timeout = self.port.timeout
+        self.port.timeout = self.timeout
         try:
+            return (buffered + self.port.read_until(terminator, size=size)).decode()
+        finally:
+            self.port.timeout = previous_timeout
 
-            with self.serial_lock:
-            
-                self.write(command)
-
-                for _ in range(self.timeout * 5):
-                    message = self.port.readline().decode().strip()
-                    
-                    if message == 'ok':
-                        return
-                    
-                    if message != '':
-                        print('Unexpected response from GRBL.') 
-                        print(f'    Command: {command.strip()}')
-                        print(f'    Response: {message}')
-                
-                print(f'GRBL serial Timeout')
-                print(f'    Command: {command.strip()}')
-                sys.exit()
+    def _readline(self):
+        """
+        Pop one newline-terminated line off the receive buffer, pulling
+        from the port by the chunk. A single read typically brings in a
+        burst of acks at once and find() is a C-level memchr, so this
+        allocates once per line instead of once per byte like
+        readline(). Returns b'' when the port times out with no
+        complete line buffered. Must be called with serial_lock held.
+        """
+        while True:
+            nl = self._rxbuf.find(b'\n')
+            if nl >= 0:
+                line = bytes(self._rxbuf[:nl])
+                del self._rxbuf[:nl + 1]
+                return line
 
-        except Exception as e:
-                print(f'Failed after command: {command.strip()}')
-                print(e)
-                sys.exit()
+            data = self.port.read(max(1, self.port.in_waiting))
+            if not data:
+                return b''
+            self._rxbuf.extend(data)
     
     def pipe_to(self, file, stop_signal: threading.Event = None):
         """ Pipe the output from the serial port to a file (eg. sys.stdout) """
         while stop_signal is None or not stop_signal.is_set():
-            message = self.port.readline().decode().strip()
-            if message.strip() != '':
-                file.write(message + '\n')
+            message = self._readline().strip()
+            if message != b'':
+                file.write(message.decode(errors='replace') + '\n')
                 file.flush()
 
     def add_command(self, command):
-        self.command_queue.put(command)
+        # queue raw bytes so the sender never encodes on the hot path;
+        # producers reading files in binary mode skip the codec entirely
+        if isinstance(command, str):
+            command = command.encode('utf-8')
+
+        # bounded: a multi-MB gcode file trickles out over hours, no
+        # point holding more than a window of it in the queue
+        with self._pending:
+            self._pending.wait_for(lambda: self._pending_count < COMMAND_QUEUE_MAX)
+            self._pending_count += 1
+        self.command_queue.append(command)
+        self._queue_event.set()
+
+    def _mark_done(self):
+        with self._pending:
+            # max() guards against an ack racing a cancel() that just
+            # zeroed the count
+            self._pending_count = max(0, self._pending_count - 1)
+            self._pending.notify_all()
 
     def _grbl_sender_loop(self):
+        try:
+            self._stream_commands()
+        except Exception as e:
+            # the board died, garbled or disconnected mid-stream (port
+            # reads/writes raise SerialException/OSError on unplug):
+            # abort the plot and wake the producer instead of letting
+            # the thread die with running still True, which would leave
+            # add_command blocked forever once the queue fills
+            logger.error('GRBL streaming failed: %s', e)
+            self.cancel()
+
+    def _stream_commands(self):
+        """
+        Character-counting streaming: keep track of how many unacked bytes
+        grbl holds in its RX buffer and ship the next line as soon as it
+        fits, instead of waiting for an 'ok' round-trip per line.
+        """
 
         self._ensure_buffer_report_enabled()
 
+        in_flight = deque() # byte size of each sent-but-unacked line
+        in_flight_bytes = 0
+
         while self.running:
-            if self.command_queue.empty():
-                # Nothing to send, short wait
-                time.sleep(0.01)
+            if not self.command_queue:
+                if in_flight:
+                    if self._consume_ack(in_flight):
+                        in_flight_bytes -= in_flight.popleft()
+                        self._mark_done()
+                else:
+                    # Nothing to send, wait for the producer
+                    self._queue_event.wait(timeout=0.01)
+                    self._queue_event.clear()
                 continue
 
-            command = self.command_queue.get(block=False)
-            buffer_nice_size = self.buffer_nice_size_for_command(command)
+            command = self.command_queue.popleft()
 
-            # Wait for a free spot in the buffer
-            while self.running:
-                
-                planning_buffer_occupancy = self.planning_buffer_occupancy()
-                # print(f'Buffer occupancy: {planning_buffer_occupancy}')
+            if self.buffer_nice_size_for_command(command) == GRBL_BUFFER_NICE_SIZE_BLOCKING:
+                # Blocking command: drain all in-flight lines, then wait for
+                # the planner buffer to mostly empty before sending it
+                while self.running and in_flight:
+                    if self._consume_ack(in_flight):
+                        in_flight_bytes -= in_flight.popleft()
+                        self._mark_done()
 
-                if planning_buffer_occupancy <= buffer_nice_size:
+                while self.running:
+                    if self.planning_buffer_occupancy() <= GRBL_BUFFER_NICE_SIZE_BLOCKING:
+                        break
+                    time.sleep(GRBL_BUFFER_SIZE_REFRESH_RATE)
+
+                self.command(command)
+                self._mark_done()
+                continue
+
+            data = command
+
+            # Wait until the line fits in grbl's RX buffer
+            while self.running and in_flight and \
+                    in_flight_bytes + len(data) > GRBL_RX_BUFFER_SIZE:
+                if self._consume_ack(in_flight):
+                    in_flight_bytes -= in_flight.popleft()
+                    self._mark_done()
+
+            # Batch everything already queued that still fits into the
+            # same write: fewer syscalls for the typical short lines
+            batch = [data]
+            batch_bytes = len(data)
+
+            while self.command_queue:
+                next_data = self.command_queue[0]
+                if self.buffer_nice_size_for_command(next_data) == GRBL_BUFFER_NICE_SIZE_BLOCKING:
+                    break
+
+                if in_flight_bytes + batch_bytes + len(next_data) > GRBL_RX_BUFFER_SIZE:
                     break
 
-                time.sleep(GRBL_BUFFER_SIZE_REFRESH_RATE)
+                self.command_queue.popleft()
+                batch.append(next_data)
+                batch_bytes += len(next_data)
+
+            with self.serial_lock:
+                self.port.write(b''.join(batch))
+
+            for sent in batch:
+                in_flight.append(len(sent))
+            in_flight_bytes += batch_bytes
+
+    def _consume_ack(self, in_flight):
+        """
+        Read one response from grbl. Returns True when a line was acked
+        (also on 'error:' responses, which ack a line too).
+        """
+        with self.serial_lock:
+            message = self._readline().strip()
 
-            # print(f'Sending command: {command.strip()}')
-            self.command(command)
-            self.command_queue.task_done()
+        # compare raw bytes: this runs once per streamed line, no need
+        # to decode acks that are thrown away
+        if message == b'ok':
+            return True
+
+        if message.startswith(b'error'):
+            logger.warning('GRBL error while streaming: %s', message.decode(errors='replace'))
+            return True
+
+        if message != b'':
+            # a chattering board can emit these once per streamed line;
+            # cap the log traffic at one warning per second
+            now = time.monotonic()
+            if now - self._last_unexpected_warn >= 1.0:
+                self._last_unexpected_warn = now
+                logger.warning('Unexpected response from GRBL: %s', message.decode(errors='replace'))
+
+        return False # read timed out, let the caller retry
 
     def _ensure_buffer_report_enabled(self):
         # Note: Only tested against GRBL 0.9
         message = self.query('$$\n')
-        for line in message.split('\n'):
-            if line.startswith('$10='):
-                report_mask = int(line[4:].split(' ')[0])
-
-                # Check if the buffer report mask is set
-                if report_mask & 0b00000100 == 0:
-                    new_report_mask = report_mask | 0b00000100
-                    self.command(f'$10={new_report_mask}\n')
-                    return
-            
-                return
-        
-        raise Exception(f'Buffer report mask not found in response to "$$": {message}')
-    
+
+        idx = message.find('$10=')
+        if idx == -1:
+            raise XidrawError(f'Buffer report mask not found in response to "$$": {message}')
+
+        value = message[idx + 4:].split('\n', 1)[0].split(' ', 1)[0]
+        report_mask = int(value)
+
+        # Check if the buffer report mask is set
+        if report_mask & 0b00000100 == 0:
+            new_report_mask = report_mask | 0b00000100
+            self.command(f'$10={new_report_mask}\n')
+
     def planning_buffer_occupancy(self):
         # Note: Only tested against GRBL 0.9
+        # queried while streaming, so parse with find() rather than
+        # splitting the whole status line into chunks
         message = self.query(self.status_command + '\n')
-        chunks = message.strip('<>').split(',')
 
-        for chunk in chunks:
-            if chunk.startswith('Buf:'):
-                return int(chunk[4:])
-        
-        raise Exception(f'Buffer size not found in status message: {message}')
+        idx = message.find('Buf:')
+        if idx == -1:
+            raise XidrawError(f'Buffer size not found in status message: {message}')
+
+        end = message.find(',', idx)
+        if end == -1:
+            end = message.find('>', idx)
+
+        return int(message[idx + 4:end if end != -1 else len(message)])
     
-    def buffer_nice_size_for_command(self, command: str):
+    def buffer_nice_size_for_command(self, command):
         # M3 commands are blocking
         # So we want want to wait until the buffer is almost empty
-        if command.strip().startswith('M3'):
+        prefix = b'M3' if isinstance(command, bytes) else 'M3'
+        if command.strip().startswith(prefix):
             return GRBL_BUFFER_NICE_SIZE_BLOCKING
         else:
             return GRBL_BUFFER_NICE_SIZE
 
     def query(self, command: str):
-        try:
 
-            with self.serial_lock:
-                
-                self.write(command)
+        with self.serial_lock:
 
-                message = []
+            self.write(command)
 
-                # consume everything until 'ok'
-                for _ in range(self.timeout * 5):
-                    chunk = self.port.readline().decode().strip()
+            # everything up to (and including) the 'ok' in one read
+            response = self._read_response()
 
-                    if chunk == 'ok':
-                        return '\n'.join(message)
-                    else:
-                        message.append(chunk)
+        lines = [line.strip() for line in response.splitlines()]
 
-        except Exception as e:
-            print(f'Failed after query: {command.strip()}')
-            print(e)
-            sys.exit()
+        if lines and lines[-1] == 'ok':
+            return '\n'.join(lines[:-1])
+
+        raise XidrawError(f'GRBL serial timeout after query: {self._printable(command)}')
     
-    def write(self, command: str):
-        self.port.write(command.encode('utf-8'))
+    def write(self, command):
+        if isinstance(command, str):
+            command = command.encode('utf-8')
+        self.port.write(command)
 
     def close(self):
         self.port.close()
     
     def start(self):
+        # a cancelled plot can leave up to a buffer's worth of in-flight
+        # lines that grbl acks after the sender stopped; flush those
+        # stale 'ok's so they don't terminate this run's first query
+        with self.serial_lock:
+            self._rxbuf.clear()
+            self.port.reset_input_buffer()
+
         # Start the gcode sender thread
-        self.running = True
+        self._stop.clear()
         self.sender_thread = threading.Thread(target=self._grbl_sender_loop)
         self.sender_thread.daemon = True
         self.sender_thread.start()
 
-    def wait_for_empty_queue(self):
-        self.command_queue.join()
+    def cancel(self):
+        """
+        Abort streaming: stop the sender thread, drop every queued line
+        and release any producer blocked in add_command or
+        wait_for_empty_queue. Safe to call from any thread.
+        """
+        self._stop.set()
+        self._queue_event.set()
+        with self._pending:
+            self.command_queue.clear()
+            self._pending_count = 0
+            self._pending.notify_all()
+
+    def wait_for_empty_queue(self, timeout=None):
+        """
+        Wait until every queued command was acked (or dropped by
+        cancel()). Returns False if `timeout` elapsed first.
+        """
+        with self._pending:
+            return self._pending.wait_for(
+                lambda: self._pending_count == 0, timeout)
 
     def wait_for_empty_planner_buffer(self):
-        while self.planning_buffer_occupancy() > 0:
+        while self.running and self.planning_buffer_occupancy() > 0:
             time.sleep(GRBL_BUFFER_SIZE_REFRESH_RATE)
-    
+
     def stop_and_join(self):
-        self.running = False
+        self._stop.set()
+        self._queue_event.set()
         self.sender_thread.join()
\ No newline at end of file
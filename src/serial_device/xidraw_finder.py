@@ -1,41 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import glob
+import logging
+from pathlib import Path
 import sys
+import tempfile
 import serial
 import serial.tools.list_ports
 from serial.tools.list_ports_common import ListPortInfo
 
 from .xidraw_device import XidrawDevice
 
+# last port a 4xidraw answered on, probed first on the next invocation
+# to skip scanning (and soft-resetting) every candidate port
+PORT_CACHE_FILE = Path(tempfile.gettempdir()) / '4xidraw-last-port'
+
+# probed before the full enumeration: list_ports.comports() walks every
+# /sys/class/tty entry parsing udev attributes, but in practice the
+# board shows up at one of these paths
+_FAST_PATHS = [
+    '/dev/ttyACM*',
+    '/dev/ttyUSB*',
+    '/dev/tty.usbmodem*',
+    '/dev/tty.usbserial*',
+]
+
+logger = logging.getLogger(__name__)
+
+
+def _read_cached_port():
+    try:
+        return PORT_CACHE_FILE.read_text().strip() or None
+    except OSError:
+        return None
+
+
+def _write_cached_port(device):
+    try:
+        PORT_CACHE_FILE.write_text(device)
+    except OSError:
+        pass # caching is best-effort
+
+def _wait_for_banner(ser):
+    """Wait up to 3s for the 'Grbl x.x' banner in one blocking read."""
+    previous_timeout = ser.timeout
+    ser.timeout = 3.0 # give 3s for the board to init
+    try:
+        data = ser.read_until(b'Grbl ')
+        if not data.endswith(b'Grbl '):
+            return False
+
+        logger.info('Grbl %s', ser.readline().decode().strip())
+        return True
+    finally:
+        ser.timeout = previous_timeout
+
+
 def open_4xidraw_port(port, baudrate=115200):
 
+    ser = None
     try:
         ser = serial.Serial(
-            port, 
+            port,
             baudrate=baudrate,
-            timeout=.2, 
-            dsrdtr=True, 
+            timeout=.2,
+            dsrdtr=True,
             rtscts=False
         )
 
-        for _ in range(15): # give 3s for the board to init
-            message = ser.readline().decode().strip()
-            if message.startswith('Grbl '):
-                print(message)
-                return ser
+        try:
+            # FTDI adapters default to a 16ms USB latency timer; this
+            # ioctl (ASYNC_LOW_LATENCY) drops it to ~1ms per read
+            ser.set_low_latency_mode(True)
+        except (AttributeError, NotImplementedError, ValueError, OSError):
+            pass # not supported on this platform or driver
+
+        if _wait_for_banner(ser):
+            return ser
 
         # trigger a soft reset
-        print('Soft reset')
+        logger.debug('Soft reset on %s', port)
         ser.write(b'\x18')
 
-        for _ in range(15): # give 3s for the board to init
-            message = ser.readline().decode().strip()
-            if message.startswith('Grbl '):
-                print(message)
-                return ser
+        if _wait_for_banner(ser):
+            return ser
 
     except (OSError, serial.SerialException):
         pass
-    
-    ser.close()
+
+    if ser is not None:
+        ser.close()
     return None
 
 
@@ -43,34 +96,87 @@ def is_compatible_device(port: ListPortInfo):
     description = port.description.lower()
     device = port.device.lower()
     return (
-        'usb' in description or 
+        'usb' in description or
         'arduino' in description or
-        'arduino' in device or 
-        'ttyUSB' in device
+        'arduino' in device or
+        'ttyusb' in device
     )
 
 
+def _probe_ports(ports):
+    """
+    Probe candidate ports in parallel: the wait costs the slowest probe
+    (up to ~3s) instead of 3s per port. Returns a XidrawDevice or None.
+    """
+    if not ports:
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        futures = {
+            executor.submit(open_4xidraw_port, port): port
+            for port in ports
+        }
+
+        winner = None
+        for future in as_completed(futures):
+            opened = future.result()
+            if opened is None:
+                continue
+            if winner is None:
+                winner = opened
+                _write_cached_port(futures[future])
+            else:
+                opened.close() # more than one device answered, keep one
+
+    if winner:
+        return XidrawDevice(winner)
+    return None
+
+
 def find_4xidraw_port():
     """
     Finds the serial port connected to a 4xidraw device.
     """
+    # try the port that answered last time first, alone
+    cached_port = _read_cached_port()
+    if cached_port and Path(cached_port).exists():
+        xidraw_port = open_4xidraw_port(cached_port)
+        if xidraw_port:
+            _write_cached_port(cached_port)
+            return XidrawDevice(xidraw_port)
+
+    # common device paths next: skips the comports() enumeration (a
+    # udev walk over every tty) in the usual single-board case
+    fast_candidates = [
+        device
+        for pattern in _FAST_PATHS
+        for device in sorted(glob.glob(pattern))
+        if device != cached_port
+    ]
+
+    device = _probe_ports(fast_candidates)
+    if device:
+        return device
+
+    # full enumeration, minus everything probed above
+    probed = set(fast_candidates)
+    probed.add(cached_port)
     xidraw_ports = [
         p.device
         for p in serial.tools.list_ports.comports()
-        if is_compatible_device(p)
+        if is_compatible_device(p) and p.device not in probed
     ]
 
-    for port in xidraw_ports:
-        xidraw_port = open_4xidraw_port(port)
-        if xidraw_port:
-            return XidrawDevice(xidraw_port)
-    
+    device = _probe_ports(xidraw_ports)
+    if device:
+        return device
+
     print("No compatible device found. Available ports:")
 
     for p in serial.tools.list_ports.comports():
-        reason ='invalid response' if p in xidraw_ports else 'not a match'
+        reason ='invalid response' if p.device in probed or p.device in xidraw_ports else 'not a match'
         print(f"\t{p.device}: {p.description} [{reason}]")
-    
+
     return None
 
 
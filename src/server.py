@@ -1,55 +1,296 @@
-import re
 from flask import Flask, jsonify, render_template, request
 from flask_cors import CORS
 import tempfile
+import mmap
+import multiprocessing
 import os
+from pathlib import Path
+import shutil
 import threading
+import time
+import uuid
 import logging
+import logging.handlers
+import queue
 from wakepy import keep
+from werkzeug.utils import secure_filename
 
 from .gen_gcode import process_svg_to_gcode
+from .serial_device.xidraw_device import XidrawError
 from .serial_device.xidraw_finder import find_4xidraw_port
 
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
 CORS(app)
 
+logger = logging.getLogger(__name__)
+
+
+def _setup_logging():
+    # decouple log emission from log writing: records go into an
+    # in-process queue and a listener thread does the actual writes, so
+    # a slow stderr never blocks the serial streaming loop
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+
+_setup_logging()
+
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit file size to 16 MB
 
-def plot_file(file_path):
+# bound what the multipart parser keeps in RAM; file parts beyond this
+# spool to disk instead of sitting in memory (tmpfs on small boards)
+app.config['MAX_FORM_MEMORY_SIZE'] = 512 * 1024
+
+# the plotter is a single physical resource: one plot job at a time,
+# handled by one long-lived worker process that keeps the serial
+# connection open between jobs (discovery costs 3s+ and soft-resets
+# the board, no reason to pay that per upload)
+_plot_process = None
+_plot_jobs = None
+_plot_busy = None
+_plot_cancel = None
+
+# one persistent upload root with a per-job subdirectory, swept by a
+# janitor thread, instead of leaking a mkdtemp() per upload
+UPLOAD_DIR = Path(tempfile.gettempdir()) / '4xidraw-uploads'
+UPLOAD_MAX_AGE = 24 * 3600 # seconds before a job directory is swept
+UPLOAD_SWEEP_INTERVAL = 300
+
+
+def _upload_janitor():
+    while True:
+        cutoff = time.time() - UPLOAD_MAX_AGE
+        try:
+            for entry in UPLOAD_DIR.iterdir():
+                if entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry, ignore_errors=True)
+        except OSError:
+            pass # sweeping is best-effort
+        time.sleep(UPLOAD_SWEEP_INTERVAL)
+
+
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+threading.Thread(target=_upload_janitor, daemon=True).start()
+
+def _save_upload(file, file_path):
+    """
+    Persist an uploaded part to file_path. When the multipart parser
+    spilled the part to disk (anything over MAX_FORM_MEMORY_SIZE), the
+    copy happens kernel-side with os.copy_file_range, skipping the
+    read()/write() bounce through user space; parts still in memory go
+    straight to werkzeug's chunked save.
+    """
+    stream = file.stream
+
+    # careful: SpooledTemporaryFile.fileno() *forces* a rollover to
+    # disk, so asking an unrolled spool for its fd would write a small
+    # in-memory part out just to copy it again
+    if not getattr(stream, '_rolled', True):
+        file.save(file_path, buffer_size=64 * 1024)
+        return
+
     try:
-        serial_port = find_4xidraw_port()
+        src_fd = stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        src_fd = None
+
+    if src_fd is not None and hasattr(os, 'copy_file_range'):
+        with open(file_path, 'wb') as dst:
+            copied = 0
+            try:
+                while True:
+                    n = os.copy_file_range(src_fd, dst.fileno(), 16 * 1024 * 1024)
+                    if n == 0:
+                        return
+                    copied += n
+            except OSError:
+                if copied:
+                    raise # partial kernel copy, don't silently restart
+                # not supported here (old kernel, odd fs), copy below
+
+    file.save(file_path, buffer_size=64 * 1024)
+
+
+def _iter_gcode_lines(file):
+    """
+    Yield raw lines from a G-code file. The file is mmap'd, so the
+    kernel pages it straight into the process and the only per-line
+    copy left is the slice itself; falls back to buffered iteration
+    when mmap is unavailable (empty file, exotic filesystem).
+    """
+    with open(file, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            yield from f
+            return
+
+        with buf:
+            start = 0
+            while True:
+                nl = buf.find(b'\n', start)
+                if nl == -1:
+                    if start < len(buf):
+                        yield buf[start:]
+                    return
+                yield buf[start:nl + 1]
+                start = nl + 1
+
+
+def send_g_code_file(serial_port, file, cancel=None):
+
+    serial_port.start()
+
+    # iterate lazily: the first line hits the serial port before the
+    # rest of the file is even read, and memory stays O(1). binary
+    # mode, so lines go to the port without an encode/decode round-trip
+    for l in _iter_gcode_lines(file):
+        if cancel is not None and cancel.is_set():
+            serial_port.cancel()
+            break
 
-        if not serial_port:
-            print('Could not initialize connection')
-            exit(1)
-        
-        def send_g_code_file(file):
+        if not serial_port.running:
+            break # the sender aborted, stop feeding it
 
-            with open(file, 'r') as f:
-                for l in f.readlines():
-                    # remove comments
-                    l = re.sub(r';.+$', '', l)
+        # comments run from the first ';' to the end of the line, a
+        # plain partition beats a regex here
+        l = l.partition(b';')[0].strip()
 
-                    if l.strip() == '':
-                        continue
+        if l == b'':
+            continue
 
-                    serial_port.command(l)
+        serial_port.add_command(l + b'\n')
 
-        with keep.running():
-            send_g_code_file(file_path)
+    # poll the cancel flag while draining, so a /cancel request still
+    # lands once the whole file is queued
+    while not serial_port.wait_for_empty_queue(timeout=0.2):
+        if cancel is not None and cancel.is_set():
+            serial_port.cancel()
+            break
 
-        serial_port.close()
+    # captured before stop_and_join (which also clears running): False
+    # here means the sender aborted on its own, not through /cancel
+    aborted = not serial_port.running
+
+    serial_port.wait_for_empty_planner_buffer()
+    serial_port.stop_and_join()
+
+    if aborted and not (cancel is not None and cancel.is_set()):
+        raise XidrawError('plot aborted before the end of the file')
+
+
+def plot_worker(jobs, busy, cancel):
+    """
+    Plot job loop, run in its own process. The serial connection is
+    kept open from one job to the next.
+
+    A job is either a ready G-code path (str) or a dict with the SVG
+    still to convert; conversion happens here so the upload request
+    returns immediately, and port discovery runs concurrently with it.
+    """
+    serial_port = None
+
+    while True:
+        job = jobs.get()
+        cancel.clear()
+
+        try:
+            if serial_port is not None and not serial_port.port.is_open:
+                serial_port = None # the device went away, rediscover
+
+            # overlap the two slow startup steps: discovering the port
+            # costs up to ~3s and converting the SVG can cost more, no
+            # reason to pay for them back to back
+            connection = {}
+
+            def connect(current=serial_port):
+                connection['port'] = current or find_4xidraw_port()
+
+            connector = threading.Thread(target=connect)
+            connector.start()
+
+            if isinstance(job, dict):
+                output_file = job['output']
+                process_svg_to_gcode(
+                    job['svg'], output_file,
+                    target_page_size=job['page_size'], split_layers=False)
+                file_path = f'{output_file}.gcode'
+            else:
+                file_path = job
+
+            connector.join()
+            serial_port = connection['port']
+
+            if not serial_port:
+                logger.error('Could not initialize connection')
+                continue
+
+            with keep.running():
+                send_g_code_file(serial_port, file_path, cancel)
+
+        except XidrawError as e:
+            # the board is in an unknown state: close the port so the
+            # next job reconnects (and soft-resets) cleanly
+            logger.error('GRBL failed while plotting: %s', e)
+            if serial_port:
+                try:
+                    serial_port.close()
+                except Exception:
+                    pass
+                serial_port = None
+
+        except Exception as e:
+            logger.exception('Error plotting file: %s', e)
+            if serial_port:
+                try:
+                    serial_port.close()
+                except Exception:
+                    pass
+                serial_port = None
+
+        finally:
+            busy.value = False
+
+def _ensure_plot_worker():
+    """Start (or restart) the plot worker process on demand."""
+    global _plot_process, _plot_jobs, _plot_busy, _plot_cancel
+
+    if _plot_process is not None and _plot_process.is_alive():
+        return
+
+    # spawn, not fork: the worker should not inherit Flask's state, and
+    # plotting in-process would contend with request handling for the GIL
+    context = multiprocessing.get_context('spawn')
+    _plot_jobs = context.Queue()
+    _plot_busy = context.Value('b', False)
+    _plot_cancel = context.Event()
+    _plot_process = context.Process(
+        target=plot_worker, args=(_plot_jobs, _plot_busy, _plot_cancel), daemon=True
+    )
+    _plot_process.start()
 
-    except Exception as e:
-        print(f"Error plotting file: {e}")
-        if serial_port:
-            serial_port.close()
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+@app.route('/cancel', methods=['POST'])
+def cancel_plot():
+    if _plot_busy is None or not _plot_busy.value:
+        return jsonify(message="No plot in progress"), 409
+
+    _plot_cancel.set()
+    return jsonify(message="Plot cancellation requested")
+
 @app.route('/plot', methods=['POST'])
 def upload_file():
     # Check if the request contains both the file and page_size
@@ -62,20 +303,35 @@ def upload_file():
     # Ensure the file and page_size exist and file has a name
     if file.filename == '' or page_size == '':
         return jsonify(message="File or page_size cannot be empty"), 400
-    
-    temp_dir = tempfile.mkdtemp()  # This will persist until you delete it manually
-    file_path = os.path.join(temp_dir, file.filename)
 
-    # Save the file to the temporary directory
-    file_path = os.path.join(temp_dir, file.filename)
-    file.save(file_path)
+    _ensure_plot_worker()
+
+    with _plot_busy.get_lock():
+        if _plot_busy.value:
+            return jsonify(message="A plot is already in progress"), 409
+        _plot_busy.value = True
+
+    try:
+        job_dir = UPLOAD_DIR / uuid.uuid4().hex
+        job_dir.mkdir()
+        file_path = os.path.join(job_dir, secure_filename(file.filename))
 
-    output_file = os.path.join(temp_dir, 'output')
-    process_svg_to_gcode(file_path, output_file, target_page_size=page_size, split_layers=False)
+        # Save the file to the job directory
+        _save_upload(file, file_path)
 
-    # Start the plotting process in a separate thread
-    thread = threading.Thread(target=plot_file, args=(f'{output_file}.gcode',))
-    thread.start()
+        # conversion happens in the worker, pipelined with the serial
+        # port bring-up, so this request returns without waiting on it
+        output_file = os.path.join(job_dir, 'output')
+        _plot_jobs.put({
+            'svg': file_path,
+            'output': output_file,
+            'page_size': page_size,
+        })
+    except Exception:
+        # release the plotter slot, the job never reached the worker
+        with _plot_busy.get_lock():
+            _plot_busy.value = False
+        raise
 
     # Return a response immediately while plotting happens in the background
     return jsonify(message=f"File '{file.filename}' uploaded successfully!", 